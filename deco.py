@@ -1,6 +1,14 @@
 #!/usr/bin/env python
 
-from functools import wraps
+from functools import lru_cache, wraps
+import os
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+USE_NUMBA = os.environ.get("USE_NUMBA") == "1" and njit is not None
 
 
 def disable(func):
@@ -50,19 +58,7 @@ def memo(func):
     faster future lookups.
     """
 
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        if args in memo_map:
-            return memo_map[args]
-
-        result = func(*args, **kwargs)
-        memo_map[args] = result
-
-        return result
-
-    memo_map = {}
-
-    return wrapper
+    return lru_cache(maxsize=None)(func)
 
 
 def n_ary(func):
@@ -74,8 +70,8 @@ def n_ary(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         if len(args) > 2:
-            result = func(*args[len(args) - 2 :], **kwargs)
-            for arg in args[: len(args) - 2][::-1]:
+            result = func(*args[-2:], **kwargs)
+            for arg in reversed(args[:-2]):
                 result = func(arg, result)
         else:
             result = func(*args, **kwargs)
@@ -106,24 +102,30 @@ def trace(trace_string):
 
     """
 
+    prefixes = [""]
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             wrapper.calls += 1
-            wrapper.trace += f"{trace_string * (wrapper.calls - 1)} --> {func.__name__}({args[0]})\n"
+            while len(prefixes) < wrapper.calls:
+                prefixes.append(prefixes[-1] + trace_string)
+            prefix = prefixes[wrapper.calls - 1]
+            wrapper.trace.append(f"{prefix} --> {func.__name__}({args[0]})\n")
 
             result = func(*args, **kwargs)
 
-            wrapper.trace += f"{trace_string * (wrapper.calls - 1)} <-- {func.__name__}({args[0]}) == {result}\n"
+            wrapper.trace.append(f"{prefix} <-- {func.__name__}({args[0]}) == {result}\n")
             wrapper.calls -= 1
 
             if not wrapper.calls:
-                print(wrapper.trace)
+                print("".join(wrapper.trace))
+                wrapper.trace.clear()
 
             return result
 
         wrapper.calls = 0
-        wrapper.trace = ""
+        wrapper.trace = []
 
         return wrapper
 
@@ -144,12 +146,26 @@ def bar(a, b):
     return a * b
 
 
-@countcalls
-@trace("####")
-@memo
-def fib(n):
-    """Some doc"""
-    return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+if USE_NUMBA:
+
+    @njit(cache=True)
+    def _fib_core(n):
+        return 1 if n <= 1 else _fib_core(n - 1) + _fib_core(n - 2)
+
+    @countcalls
+    @memo
+    def fib(n):
+        """Some doc"""
+        return _fib_core(n)
+
+else:
+
+    @countcalls
+    @trace("####")
+    @memo
+    def fib(n):
+        """Some doc"""
+        return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
 
 
 def main():
@@ -1,120 +1,307 @@
 #!/usr/bin/env python
 from argparse import ArgumentParser
-from collections import defaultdict
+from array import array
 from configparser import ConfigParser, SectionProxy
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from functools import partial
+from mmap import ACCESS_READ, mmap
+from multiprocessing import Pool
 from operator import itemgetter
 from pathlib import Path
 from statistics import median
-from string import Template
-from typing import Generator, TypeAlias
+from typing import BinaryIO, Generator, Iterable, TypeAlias
+import io
+import os
 import re
 import gzip
 import json
+import heapq
 import logging
 
-PreparatoryData: TypeAlias = dict[str, dict[str, int | list]]
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# url -> [count, time_sum, time_max, times]
+PreparatoryData: TypeAlias = dict[str, list[int | float | array]]
 
 # log_format ui_short '$remote_addr  $remote_user $http_x_real_ip [$time_local] "$request" '
 #                     '$status $body_bytes_sent "$http_referer" '
 #                     '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" "$http_X_RB_USER" '
 #                     '$request_time';
 
-LOG_FORMAT_PATTERN = r'".+? (.+?) .+?" .+ (\d+\.\d+)'
+LOG_FORMAT_PATTERN = rb'"[^ "\n]+ ([^ "\n]+) [^"\n]*" .+ (\d+\.\d+)'
 FILENAME_PATTERN = r"(nginx-access-ui.log-)(\d{8})\.(gz|txt)"
+LOG_FORMAT_RE = re.compile(LOG_FORMAT_PATTERN)
+FILENAME_RE = re.compile(FILENAME_PATTERN)
+TABLE_JSON_PLACEHOLDER = "$table_json"
 ERROR_RATE = 0.2
-NUMBER_OF_MISTAKES = 0
+MEDIAN_NUMPY_THRESHOLD = 32
+CHUNK_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+
+
+def setup_logging(log_file: str | None) -> None:
+    logging.basicConfig(filename=log_file, format="[%(asctime)s] %(levelname).1s %(message)s", level=logging.INFO)
 
 
 def get_last_sample(log_dir: Path) -> tuple[Path | None, datetime | None]:
     date = None
     filename = None
 
-    for file in log_dir.iterdir():
-        if not file.is_file():
-            continue
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+
+            match = FILENAME_RE.match(entry.name)
+            if match is None:
+                continue
+
+            # "YYYYMMDD" strings sort in date order, so only the latest one is parsed
+            new_date = match.group(2)
+            if date is None or new_date > date:
+                date = new_date
+                filename = entry.path
+
+    if date is None:
+        return None, None
+
+    return Path(filename), datetime.strptime(date, "%Y%m%d").replace(tzinfo=timezone.utc)
+
+
+def open_gzip(filename: Path) -> BinaryIO:
+    if rapidgzip is not None:
+        # RapidgzipFile is a raw stream, iterating it directly reads lines byte by byte
+        return io.BufferedReader(rapidgzip.open(str(filename), parallelization=0), buffer_size=BUFFER_SIZE)
+
+    return gzip.open(filename, mode="rb")
+
+
+@contextmanager
+def map_log(filename: Path) -> Generator[mmap | bytes, None, None]:
+    with filename.open(mode="rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            yield b""
+            return
+
+        with mmap(f.fileno(), 0, access=ACCESS_READ) as buffer:
+            yield buffer
+
+
+def parse_lines(lines: Iterable[bytes], errors: list[int]) -> Generator[tuple[str, float], None, None]:
+    search = LOG_FORMAT_RE.search
+    unmatched_count = 0
+
+    for line in lines:
+        match = search(line)
 
-        match = re.match(pattern=FILENAME_PATTERN, string=file.name)
         if match is None:
+            unmatched_count += 1
+            continue
+        try:
+            request, request_time = match.group(1).decode("UTF-8"), float(match.group(2))
+        except ValueError:
+            errors[0] += 1
+            logging.exception("Logging format could not be parsed")
             continue
 
-        new_filename = file
-        new_date = datetime.strptime(match.groups()[1], "%Y%m%d").replace(tzinfo=timezone.utc)
+        yield request, request_time
 
-        if date is None:
-            date = new_date
-            filename = new_filename
-        else:
-            if new_date > date:
-                date = new_date
-                filename = file
+    log_unmatched(unmatched_count=unmatched_count, errors=errors)
 
-    return filename, date
 
+def log_unmatched(unmatched_count: int, errors: list[int]) -> None:
+    if unmatched_count:
+        errors[0] += unmatched_count
+        logging.error(f"Logging format has been changed in {unmatched_count} lines")
 
-def get_lines(filename: Path) -> Generator[tuple[str, float], None, None]:
-    opener = gzip.open if filename.suffix == ".gz" else open
-    global NUMBER_OF_MISTAKES
 
-    with opener(filename, mode="rb") as f:
-        for line in f.readlines():
-            match = re.search(LOG_FORMAT_PATTERN, line.decode("UTF-8"))
+def count_lines(buffer: mmap | bytes, start: int, end: int) -> int:
+    # Slicing an mmap copies, so the range is counted in BUFFER_SIZE blocks
+    lines_count = 0
+    for block_start in range(start, end, BUFFER_SIZE):
+        lines_count += buffer[block_start : min(block_start + BUFFER_SIZE, end)].count(b"\n")
 
-            if match is None:
-                NUMBER_OF_MISTAKES += 1
-                logging.error("Logging format has been changed")
-                continue
-            try:
-                request, request_time = match.group(1), float(match.group(2))
-            except ValueError:
-                NUMBER_OF_MISTAKES += 1
-                logging.exception("Logging format could not be parsed")
-                continue
+    if end > start and buffer[end - 1 : end] != b"\n":
+        lines_count += 1
+
+    return lines_count
+
+
+def parse_buffer(
+    buffer: mmap | bytes, errors: list[int], start: int = 0, end: int | None = None
+) -> Generator[tuple[str, float], None, None]:
+    end = len(buffer) if end is None else end
+    matches_count = 0
+
+    for match in LOG_FORMAT_RE.finditer(buffer, start, end):
+        matches_count += 1
+
+        try:
+            request, request_time = match.group(1).decode("UTF-8"), float(match.group(2))
+        except ValueError:
+            errors[0] += 1
+            logging.exception("Logging format could not be parsed")
+            continue
+
+        yield request, request_time
+
+    # The pattern classes exclude newlines and the greedy ".+" before the request time runs to the
+    # last time on the line, so every match lies within one line and no line yields two matches
+    lines_count = count_lines(buffer=buffer, start=start, end=end)
+
+    log_unmatched(unmatched_count=lines_count - matches_count, errors=errors)
+
+
+def get_lines(filename: Path, errors: list[int]) -> Generator[tuple[str, float], None, None]:
+    if filename.suffix == ".gz":
+        with open_gzip(filename=filename) as f:
+            yield from parse_lines(lines=f, errors=errors)
+    else:
+        with map_log(filename=filename) as buffer:
+            yield from parse_buffer(buffer=buffer, errors=errors)
+
+
+def get_chunks(filename: Path, chunk_size: int) -> list[tuple[int, int]]:
+    bounds = [0]
+
+    with filename.open(mode="rb") as f:
+        size = f.seek(0, os.SEEK_END)
 
-            yield request, request_time
+        while bounds[-1] + chunk_size < size:
+            f.seek(bounds[-1] + chunk_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+
+    bounds.append(size)
+
+    return list(zip(bounds, bounds[1:]))
 
 
 def get_preparatory_data(lines: Generator[tuple[str, float], None, None]) -> tuple[int, float, PreparatoryData]:
-    data = defaultdict(lambda: {"count": 0, "times": []})
+    data = {}
     total_count = 0
     total_time = 0.0
 
     for request, request_time in lines:
-        request_time = request_time
-        data[request]["count"] += 1
-        data[request]["times"].append(request_time)
+        request_data = data.get(request)
+        if request_data is None:
+            request_data = data[request] = [0, 0.0, 0.0, array("d")]
+        request_data[0] += 1
+        request_data[1] += request_time
+        if request_time > request_data[2]:
+            request_data[2] = request_time
+        request_data[3].append(request_time)
         total_count += 1
         total_time += request_time
 
     return total_count, total_time, data
 
 
+def get_chunk_preparatory_data(filename: Path, chunk: tuple[int, int]) -> tuple[int, float, PreparatoryData, int]:
+    errors = [0]
+
+    with map_log(filename=filename) as buffer:
+        lines = parse_buffer(buffer=buffer, errors=errors, start=chunk[0], end=chunk[1])
+        total_count, total_time, data = get_preparatory_data(lines=lines)
+
+    return total_count, total_time, data, errors[0]
+
+
+def get_parallel_preparatory_data(
+    filename: Path, errors: list[int], workers: int, log_file: str | None = None, chunk_size: int = CHUNK_SIZE
+) -> tuple[int, float, PreparatoryData]:
+    chunks = get_chunks(filename=filename, chunk_size=chunk_size)
+    if len(chunks) == 1:
+        return get_preparatory_data(lines=get_lines(filename=filename, errors=errors))
+
+    data = {}
+    total_count = 0
+    total_time = 0.0
+
+    # Workers started with "spawn" do not inherit the parent's logging setup
+    with Pool(processes=min(workers, len(chunks)), initializer=setup_logging, initargs=(log_file,)) as pool:
+        for chunk_count, chunk_time, chunk_data, mistakes in pool.imap(
+            partial(get_chunk_preparatory_data, filename), chunks
+        ):
+            for request, (count, time_sum, time_max, times) in chunk_data.items():
+                request_data = data.get(request)
+                if request_data is None:
+                    data[request] = [count, time_sum, time_max, times]
+                    continue
+                request_data[0] += count
+                request_data[1] += time_sum
+                request_data[2] = max(request_data[2], time_max)
+                request_data[3].extend(times)
+
+            total_count += chunk_count
+            total_time += chunk_time
+            errors[0] += mistakes
+
+    return total_count, total_time, data
+
+
+def get_median(times: array) -> float:
+    if np is None or len(times) < MEDIAN_NUMPY_THRESHOLD:
+        return median(times)
+
+    k = len(times) // 2
+    if len(times) % 2:
+        return float(np.partition(np.frombuffer(times, dtype=np.float64), k)[k])
+
+    partitioned = np.partition(np.frombuffer(times, dtype=np.float64), (k - 1, k))
+    return float((partitioned[k - 1] + partitioned[k]) / 2)
+
+
 def get_report_data(total_count: int, total_time: float, data: PreparatoryData) -> Generator[dict, None, None]:
-    for url, preparatory_data in data.items():
-        count = preparatory_data["count"]
-        time_sum = round(sum(preparatory_data["times"]), 3)
+    for url, (count, time_sum, time_max, times) in data.items():
+        time_sum = round(time_sum, 3)
 
         yield {
             "url": url,
             "count": count,
             "time_avg": round(time_sum / count, 3),
-            "time_max": round(max(preparatory_data["times"]), 3),
+            "time_max": round(time_max, 3),
             "time_sum": time_sum,
-            "time_med": round(median(preparatory_data["times"]), 3),
+            "time_med": round(get_median(times), 3),
             "time_perc": round(time_sum / total_time, 3),
             "count_perc": round(count / total_count, 3),
         }
 
 
+def dump_json(data: list[dict]) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode("UTF-8")
+
+    return json.dumps(data)
+
+
 def prepare_report(
     data: Generator[dict, None, None], report_file: Path, report_size: int, report_template: Path
 ) -> None:
-    with report_file.open("w") as file:
-        file.write(
-            Template(template=report_template.read_text(encoding="UTF-8")).safe_substitute(
-                table_json=json.dumps(sorted(data, key=itemgetter("time_sum"), reverse=True)[:report_size])
-            )
-        )
+    table_json = dump_json(heapq.nlargest(report_size, data, key=itemgetter("time_sum")))
+    prefix, placeholder, suffix = report_template.read_text(encoding="UTF-8").partition(TABLE_JSON_PLACEHOLDER)
+
+    with report_file.open("w", encoding="UTF-8") as file:
+        file.write(prefix)
+        if placeholder:
+            file.write(table_json)
+        file.write(suffix)
 
     logging.info(f"Wrote report to '{report_file}'")
 
@@ -136,14 +323,21 @@ def main(config: SectionProxy) -> None:
         logging.info("The report already exists")
         return
 
-    lines = get_lines(filename=filename)
-    total_count, total_time, preparatory_data = get_preparatory_data(lines=lines)
+    errors = [0]
+    workers = config.getint("WORKERS")
+    if filename.suffix == ".gz" or workers <= 1:
+        lines = get_lines(filename=filename, errors=errors)
+        total_count, total_time, preparatory_data = get_preparatory_data(lines=lines)
+    else:
+        total_count, total_time, preparatory_data = get_parallel_preparatory_data(
+            filename=filename, errors=errors, workers=workers, log_file=config.get("LOG_FILE")
+        )
 
-    if total_count != 0 and NUMBER_OF_MISTAKES / total_count > ERROR_RATE:
+    if total_count != 0 and errors[0] / total_count > ERROR_RATE:
         logging.error("The number of errors exceeds the acceptable threshold")
         return
 
-    logging.info(f"Error rate: {NUMBER_OF_MISTAKES / total_count if total_count != 0 else 0}")
+    logging.info(f"Error rate: {errors[0] / total_count if total_count != 0 else 0}")
 
     data = get_report_data(total_count=total_count, total_time=total_time, data=preparatory_data)
     prepare_report(
@@ -177,15 +371,14 @@ if __name__ == "__main__":
                     "REPORT_DIR": "./reports",
                     "LOG_DIR": "./log",
                     "REPORT_TEMPLATE": "./report.html",
+                    "WORKERS": os.cpu_count() or 1,
                 }
             }
         )
         config = config_parser["DEFAULT"]
         config_parser.read(config_file)
 
-        logging.basicConfig(
-            filename=config.get("LOG_FILE"), format="[%(asctime)s] %(levelname).1s %(message)s", level=logging.INFO
-        )
+        setup_logging(log_file=config.get("LOG_FILE"))
 
         if Path(config.get("REPORT_TEMPLATE")).exists():
             main(config=config)
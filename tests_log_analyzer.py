@@ -1,10 +1,26 @@
+from array import array
 from datetime import datetime, timezone
 from pathlib import Path
-from unittest import TestCase
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+import io
 import gzip
+import json
 import tempfile
 
-from log_analyzer import get_last_sample, get_lines, get_preparatory_data, get_report_data
+from log_analyzer import (
+    get_chunks,
+    get_last_sample,
+    get_lines,
+    get_median,
+    get_parallel_preparatory_data,
+    get_preparatory_data,
+    get_report_data,
+    open_gzip,
+    parse_buffer,
+    prepare_report,
+)
+import log_analyzer
 
 
 class TestLogAnalyzer(TestCase):
@@ -49,6 +65,22 @@ class TestLogAnalyzer(TestCase):
             self.assertTrue(filename.is_file())
             self.assertEqual(datetime.strptime("20170630", "%Y%m%d").replace(tzinfo=timezone.utc), data)
 
+    def test_get_last_sample_latest_file(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_dir = Path(log_dir)
+
+            for name in [
+                "nginx-access-ui.log-20170630.gz",
+                "nginx-access-ui.log-20170701.txt",
+                "nginx-access-ui.log-20170629.txt",
+            ]:
+                with open(log_dir / name, "wb") as f:
+                    f.write(b"")
+
+            filename, data = get_last_sample(log_dir=Path(log_dir))
+            self.assertEqual("nginx-access-ui.log-20170701.txt", filename.name)
+            self.assertEqual(datetime.strptime("20170701", "%Y%m%d").replace(tzinfo=timezone.utc), data)
+
     def test_get_lines_empty_txt_file(self):
         with tempfile.TemporaryDirectory() as log_dir:
             log_dir = Path(log_dir)
@@ -57,7 +89,7 @@ class TestLogAnalyzer(TestCase):
             with open(filename, "w") as f:
                 f.write("")
 
-            lines = get_lines(filename=filename)
+            lines = get_lines(filename=filename, errors=[0])
             self.assertEqual(0, len(list(lines)))
 
     def test_get_lines_empty_gz_file(self):
@@ -68,7 +100,7 @@ class TestLogAnalyzer(TestCase):
             with gzip.open(filename, "wb") as f:
                 f.write(b"")
 
-            lines = get_lines(filename=filename)
+            lines = get_lines(filename=filename, errors=[0])
             self.assertEqual(0, len(list(lines)))
 
     def test_get_lines_not_empty_txt_file(self):
@@ -85,10 +117,43 @@ class TestLogAnalyzer(TestCase):
                     ]
                 )
 
-            lines = list(get_lines(filename=filename))
+            errors = [0]
+            lines = list(get_lines(filename=filename, errors=errors))
             self.assertEqual(1, len(lines))
+            self.assertListEqual([0], errors)
             self.assertEqual(("/api/v2/banner/25019354", 0.39), lines[0])
 
+    def test_get_lines_skips_malformed_request(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_dir = Path(log_dir)
+            filename = log_dir / "nginx-access-ui.log-20170630.txt"
+
+            with open(filename, "w") as f:
+                f.writelines(
+                    [
+                        '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "-" 400 0'
+                        ' "-" "-" "-" "1498697422-2190034393-4708-9752759" "-" 0.001'
+                    ]
+                )
+
+            errors = [0]
+            lines = list(get_lines(filename=filename, errors=errors))
+            self.assertEqual(0, len(lines))
+            self.assertListEqual([1], errors)
+
+    def test_parse_buffer(self):
+        line = (
+            b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/25019354 HTTP/1.1" 200 927'
+            b' "-" "-" "-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390'
+        )
+        buffer = b"\n".join([b"broken", line, b"", line, b"broken"])
+        errors = [0]
+
+        lines = list(parse_buffer(buffer=buffer, errors=errors))
+
+        self.assertListEqual([("/api/v2/banner/25019354", 0.39)] * 2, lines)
+        self.assertListEqual([3], errors)
+
     def test_get_lines_not_empty_gz_file(self):
         with tempfile.TemporaryDirectory() as log_dir:
             log_dir = Path(log_dir)
@@ -103,10 +168,115 @@ class TestLogAnalyzer(TestCase):
                     ]
                 )
 
-            lines = list(get_lines(filename=filename))
+            errors = [0]
+            lines = list(get_lines(filename=filename, errors=errors))
             self.assertEqual(1, len(lines))
+            self.assertListEqual([0], errors)
             self.assertEqual(("/api/v2/banner/25019354", 0.39), lines[0])
 
+    @skipIf(log_analyzer.rapidgzip is None, "rapidgzip is not installed")
+    def test_open_gzip_rapidgzip(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            filename = Path(log_dir) / "nginx-access-ui.log-20170630.gz"
+
+            with gzip.open(filename, "wb") as f:
+                f.write(b"first\nsecond\n")
+
+            with open_gzip(filename=filename) as f:
+                self.assertIsInstance(f, io.BufferedReader)
+                self.assertListEqual([b"first\n", b"second\n"], list(f))
+
+    def test_open_gzip_without_rapidgzip(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            filename = Path(log_dir) / "nginx-access-ui.log-20170630.gz"
+
+            with gzip.open(filename, "wb") as f:
+                f.write(b"first\nsecond\n")
+
+            with patch("log_analyzer.rapidgzip", None), open_gzip(filename=filename) as f:
+                self.assertIsInstance(f, gzip.GzipFile)
+                self.assertListEqual([b"first\n", b"second\n"], list(f))
+
+    def test_get_lines_logs_unmatched_lines_once(self):
+        line = (
+            b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/25019354 HTTP/1.1" 200 927'
+            b' "-" "-" "-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n'
+        )
+
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_dir = Path(log_dir)
+
+            with gzip.open(log_dir / "nginx-access-ui.log-20170630.gz", "wb") as f:
+                f.write(b"broken\n" + line + b"broken\n")
+            (log_dir / "nginx-access-ui.log-20170630.txt").write_bytes(b"broken\n" + line + b"broken\n")
+
+            for filename in log_dir.iterdir():
+                errors = [0]
+                with self.assertLogs(level="ERROR") as logs:
+                    lines = list(get_lines(filename=filename, errors=errors))
+
+                self.assertListEqual([("/api/v2/banner/25019354", 0.39)], lines)
+                self.assertListEqual([2], errors)
+                self.assertListEqual(["ERROR:root:Logging format has been changed in 2 lines"], logs.output)
+
+    def test_get_chunks(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            filename = Path(log_dir) / "nginx-access-ui.log-20170630.txt"
+            filename.write_bytes(b"aaa\nbbbbbb\ncc\nd")
+
+            self.assertListEqual([(0, 4), (4, 11), (11, 14), (14, 15)], get_chunks(filename=filename, chunk_size=2))
+            self.assertListEqual([(0, 15)], get_chunks(filename=filename, chunk_size=100))
+
+    def test_get_parallel_preparatory_data(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            filename = Path(log_dir) / "nginx-access-ui.log-20170630.txt"
+            filename.write_bytes(
+                b"".join(
+                    b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/%d HTTP/1.1" 200 927'
+                    b' "-" "-" "-" "-" "-" 0.%03d\n' % (i % 7, i)
+                    if i % 30
+                    else b"broken\n"
+                    for i in range(100)
+                )
+            )
+
+            errors, parallel_errors = [0], [0]
+            total_count, total_time, data = get_preparatory_data(lines=get_lines(filename=filename, errors=errors))
+            parallel_total_count, parallel_total_time, parallel_data = get_parallel_preparatory_data(
+                filename=filename, errors=parallel_errors, workers=2, chunk_size=1000
+            )
+
+        self.assertListEqual([4], errors)
+        self.assertListEqual(errors, parallel_errors)
+        self.assertEqual(total_count, parallel_total_count)
+        self.assertAlmostEqual(total_time, parallel_total_time)
+        self.assertSetEqual(set(data), set(parallel_data))
+        for request, (count, time_sum, time_max, times) in data.items():
+            self.assertEqual(count, parallel_data[request][0])
+            self.assertAlmostEqual(time_sum, parallel_data[request][1])
+            self.assertEqual(time_max, parallel_data[request][2])
+            self.assertEqual(times, parallel_data[request][3])
+
+    def test_get_parallel_preparatory_data_single_chunk(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            filename = Path(log_dir) / "nginx-access-ui.log-20170630.txt"
+            filename.write_bytes(
+                b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/25019354 HTTP/1.1" 200 927'
+                b' "-" "-" "-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n'
+            )
+
+            errors = [0]
+            with patch("log_analyzer.Pool") as pool:
+                total_count, total_time, data = get_parallel_preparatory_data(
+                    filename=filename, errors=errors, workers=2
+                )
+
+        pool.assert_not_called()
+        self.assertListEqual([0], errors)
+        self.assertEqual(1, total_count)
+        self.assertEqual(0.39, total_time)
+        self.assertDictEqual({"/api/v2/banner/25019354": [1, 0.39, 0.39, array("d", [0.39])]}, data)
+
     def test_get_preparatory_data(self):
         lines = (log_item for log_item in [("/api/v2/banner/25019354", 0.39)])
 
@@ -114,10 +284,24 @@ class TestLogAnalyzer(TestCase):
 
         self.assertEqual(1, total_count)
         self.assertEqual(0.39, total_time)
-        self.assertDictEqual({"/api/v2/banner/25019354": {"count": 1, "times": [0.39]}}, data)
+        self.assertDictEqual({"/api/v2/banner/25019354": [1, 0.39, 0.39, array("d", [0.39])]}, data)
+
+    def test_get_preparatory_data_same_request(self):
+        lines = (log_item for log_item in [("/api/v2/banner/25019354", 0.39), ("/api/v2/banner/25019354", 0.5)])
+
+        total_count, total_time, data = get_preparatory_data(lines=lines)
+
+        self.assertEqual(2, total_count)
+        self.assertAlmostEqual(0.89, total_time)
+        self.assertListEqual([2, 0.89, 0.5, array("d", [0.39, 0.5])], data["/api/v2/banner/25019354"])
+
+    def test_get_median(self):
+        self.assertEqual(0.39, get_median(array("d", [0.39])))
+        self.assertEqual(50.0, get_median(array("d", range(101))[::-1]))
+        self.assertEqual(49.5, get_median(array("d", range(100))[::-1]))
 
     def test_get_report_data(self):
-        preparatory_data = {"/api/v2/banner/25019354": {"count": 1, "times": [0.39]}}
+        preparatory_data = {"/api/v2/banner/25019354": [1, 0.39, 0.39, array("d", [0.39])]}
 
         data = list(get_report_data(total_count=1, total_time=0.39, data=preparatory_data))
 
@@ -135,3 +319,30 @@ class TestLogAnalyzer(TestCase):
             },
             data[0],
         )
+
+    def test_prepare_report(self):
+        data = (
+            {"url": f"/api/v2/banner/{i}", "count": 1, "time_sum": time_sum}
+            for i, time_sum in enumerate([0.1, 0.3, 0.2])
+        )
+
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_dir = Path(report_dir)
+            report_template = report_dir / "report.html"
+            report_template.write_text("<script>var table = $table_json;</script>", encoding="UTF-8")
+            report_file = report_dir / "report-2017.06.30.html"
+
+            prepare_report(data=data, report_file=report_file, report_size=2, report_template=report_template)
+
+            report = report_file.read_text(encoding="UTF-8")
+
+        prefix, suffix = "<script>var table = ", ";</script>"
+        self.assertTrue(report.startswith(prefix))
+        self.assertTrue(report.endswith(suffix))
+        self.assertListEqual(
+            [
+                {"url": "/api/v2/banner/1", "count": 1, "time_sum": 0.3},
+                {"url": "/api/v2/banner/2", "count": 1, "time_sum": 0.2},
+            ],
+            json.loads(report[len(prefix) : -len(suffix)]),
+        )